@@ -6,6 +6,11 @@ use num::traits::Num;
 use thiserror::Error;
 
 use super::price_level::PriceLevel;
+use super::tracker::TopNLevels;
+
+/// Number of best price levels each book side keeps resident in its contiguous
+/// top N window. Deeper levels live only in the level map.
+pub const TOP_N_DEPTH: usize = 16;
 
 pub enum FoundLevelType {
     New,
@@ -30,6 +35,7 @@ pub enum DeleteError {
 pub struct BookSide<Price, Qty> {
     is_bid: bool,
     levels: HashMap<Price, PriceLevel<Price, Qty>>,
+    top_n_levels: TopNLevels<Price, Qty, TOP_N_DEPTH>,
     pub best_price: Option<Price>,
     pub best_price_qty: Option<Qty>,
 }
@@ -42,11 +48,29 @@ impl<Price: Debug + Copy + Eq + Ord + Hash, Qty: Debug + Copy + PartialEq + Ord
         BookSide {
             is_bid,
             levels: HashMap::new(),
+            top_n_levels: TopNLevels::new(is_bid),
             best_price: None,
             best_price_qty: None,
         }
     }
 
+    #[inline]
+    pub fn is_bid(&self) -> bool {
+        self.is_bid
+    }
+
+    /// Prices of the resident top levels, ordered from best to worst.
+    #[inline]
+    pub fn top_n_prices(&self) -> &[Price] {
+        self.top_n_levels.prices()
+    }
+
+    /// Quantities of the resident top levels, ordered from best to worst price.
+    #[inline]
+    pub fn top_n_qtys(&self) -> &[Qty] {
+        self.top_n_levels.qtys()
+    }
+
     #[inline]
     pub fn get_level(&self, price: Price) -> Option<&PriceLevel<Price, Qty>> {
         self.levels.get(&price)
@@ -65,62 +89,84 @@ impl<Price: Debug + Copy + Eq + Ord + Hash, Qty: Debug + Copy + PartialEq + Ord
         }
     }
 
+    /// Locate `price` in the top N window. Most events in a book happen at the
+    /// top of book, so the best price is checked before searching the window.
     #[inline]
-    fn update_best_price_after_add(
-        &mut self,
-        found_level_type: FoundLevelType,
-        added_price: Price,
-        added_qty: Qty,
-    ) {
-        match (
-            found_level_type,
-            self.is_bid,
-            self.best_price.map(|px| px.cmp(&added_price)),
-        ) {
-            // Adding qty to existing best price
-            (FoundLevelType::Existing, _, Some(std::cmp::Ordering::Equal)) => {
-                self.best_price_qty = self.best_price_qty.map(|qty| qty + added_qty);
+    fn find_in_top_n(&self, price: Price) -> Result<usize, usize> {
+        if self.best_price == Some(price) {
+            Ok(0)
+        } else {
+            self.top_n_levels.find(price)
+        }
+    }
+
+    /// Keep the top N window in sync after `price` gained qty and now holds `level_qty`.
+    #[inline]
+    fn update_top_n_after_add(&mut self, price: Price, level_qty: Qty) {
+        match self.find_in_top_n(price) {
+            Ok(idx) => self.update_top_n_qty(idx, level_qty),
+            // Only levels better than a resident level may enter the window, unless
+            // every other level of the book side is already resident.
+            Err(idx)
+                if idx < self.top_n_levels.len()
+                    || self.levels.len() == self.top_n_levels.len() + 1 =>
+            {
+                self.top_n_levels.insert(idx, price, level_qty);
+                if idx == 0 {
+                    self.update_best_price();
+                }
             }
-            // New price is better than current best price
-            (FoundLevelType::New, _, None)
-            | (FoundLevelType::New, true, Some(std::cmp::Ordering::Less))
-            | (FoundLevelType::New, false, Some(std::cmp::Ordering::Greater)) => {
-                self.best_price = Some(added_price);
-                self.best_price_qty = Some(added_qty);
+            Err(_) => {}
+        }
+    }
+
+    #[inline]
+    fn update_top_n_after_level_delete(&mut self, deleted_price: Price) {
+        if let Ok(idx) = self.find_in_top_n(deleted_price) {
+            self.top_n_levels.remove(idx);
+            if self.top_n_levels.is_empty() && !self.levels.is_empty() {
+                self.top_n_levels
+                    .refill(self.levels.values().map(|l| (l.price, l.qty)));
             }
-            (FoundLevelType::New, _, Some(std::cmp::Ordering::Equal)) => panic!(
-                "update_best_price_after_add: New level has same price as current best price"
-            ),
-            (FoundLevelType::Existing, _, None) => {
-                panic!(
-                    "update_best_price_after_add: If there is an existing level then best price should not be None"
-                )
+            if idx == 0 {
+                self.update_best_price();
             }
-            _ => {}
         }
     }
 
     #[inline]
-    fn update_best_price_after_level_delete(&mut self, deleted_price: Price) {
-        if self.best_price == Some(deleted_price) {
-            (self.best_price, self.best_price_qty) = self
-                .get_best_price_level()
-                .map_or((None, None), |l| (Some(l.price), Some(l.qty)));
+    fn update_top_n_after_qty_change(&mut self, price: Price, level_qty: Qty) {
+        if let Ok(idx) = self.find_in_top_n(price) {
+            self.update_top_n_qty(idx, level_qty);
         }
     }
 
     #[inline]
-    fn update_best_price_after_qty_delete(&mut self, deleted_price: Price, deleted_qty: Qty) {
-        if self.best_price == Some(deleted_price) {
-            self.best_price_qty = self.best_price_qty.map(|qty| qty - deleted_qty);
+    fn update_top_n_qty(&mut self, idx: usize, level_qty: Qty) {
+        self.top_n_levels.set_qty(idx, level_qty);
+        if idx == 0 {
+            self.best_price_qty = Some(level_qty);
         }
     }
 
+    #[inline]
+    fn update_best_price(&mut self) {
+        (self.best_price, self.best_price_qty) = self
+            .top_n_levels
+            .best()
+            .map_or((None, None), |(price, qty)| (Some(price), Some(qty)));
+    }
+
+    /// Adding zero qty is a no-op, so it never creates an empty level.
     #[inline]
     pub fn add_qty(&mut self, price: Price, qty: Qty) {
-        let (found_level_type, level) = self.find_or_create_level(price);
+        if qty.is_zero() {
+            return;
+        }
+        let (_, level) = self.find_or_create_level(price);
         level.add_qty(qty);
-        self.update_best_price_after_add(found_level_type, price, qty);
+        let level_qty = level.qty;
+        self.update_top_n_after_add(price, level_qty);
     }
 
     #[inline]
@@ -133,23 +179,50 @@ impl<Price: Debug + Copy + Eq + Ord + Hash, Qty: Debug + Copy + PartialEq + Ord
             std::cmp::Ordering::Less => return Err(DeleteError::QtyExceedsAvailable),
             std::cmp::Ordering::Equal => {
                 self.levels.remove(&price);
-                self.update_best_price_after_level_delete(price);
+                self.update_top_n_after_level_delete(price);
             }
             std::cmp::Ordering::Greater => {
                 level.delete_qty(qty);
-                self.update_best_price_after_qty_delete(price, qty);
+                let level_qty = level.qty;
+                self.update_top_n_after_qty_change(price, level_qty);
             }
         }
         Ok(())
     }
 
+    /// Replace `prev_qty` with `new_qty` at a single price level, e.g. for an
+    /// order whose qty is modified without changing its price. This is a single
+    /// level lookup rather than a delete followed by an add. A modify which
+    /// leaves the level without qty removes it, as a delete would.
     #[inline]
-    pub fn get_best_price_level(&self) -> Option<&PriceLevel<Price, Qty>> {
-        if self.is_bid {
-            self.levels.values().max_by_key(|l| l.price)
+    pub fn modify_qty(
+        &mut self,
+        price: Price,
+        prev_qty: Qty,
+        new_qty: Qty,
+    ) -> Result<(), DeleteError> {
+        let level = self
+            .levels
+            .get_mut(&price)
+            .ok_or(LevelError::LevelNotFound)?;
+        if level.qty < prev_qty {
+            return Err(DeleteError::QtyExceedsAvailable);
+        }
+        level.delete_qty(prev_qty);
+        level.add_qty(new_qty);
+        let level_qty = level.qty;
+        if level_qty.is_zero() {
+            self.levels.remove(&price);
+            self.update_top_n_after_level_delete(price);
         } else {
-            self.levels.values().min_by_key(|l| l.price)
+            self.update_top_n_after_qty_change(price, level_qty);
         }
+        Ok(())
+    }
+
+    #[inline]
+    pub fn get_best_price_level(&self) -> Option<&PriceLevel<Price, Qty>> {
+        self.best_price.and_then(|price| self.levels.get(&price))
     }
 }
 
@@ -298,6 +371,113 @@ mod tests {
         }
     }
 
+    #[test]
+    fn test_best_price_beyond_top_n_depth() {
+        let num_levels = 3 * TOP_N_DEPTH as u32;
+        for is_bid in vec![true, false] {
+            let mut book_side = BookSide::new(is_bid);
+            for price in 1..=num_levels {
+                book_side.add_qty(price, price * 10);
+            }
+            let mut prices: Vec<u32> = (1..=num_levels).collect();
+            if is_bid {
+                prices.reverse();
+            }
+            for (i, &price) in prices.iter().enumerate() {
+                assert_eq!(book_side.best_price, Some(price));
+                assert_eq!(book_side.best_price_qty, Some(price * 10));
+                book_side.delete_qty(price, price * 10).unwrap();
+                assert_eq!(book_side.levels.len(), prices.len() - i - 1);
+            }
+            assert_eq!(book_side.best_price, None);
+            assert_eq!(book_side.best_price_qty, None);
+            assert!(book_side.top_n_prices().is_empty());
+        }
+    }
+
+    #[test]
+    fn test_add_qty_to_level_below_top_n() {
+        let mut book_side = BookSide::new(true);
+        for price in 1..=(2 * TOP_N_DEPTH as u32) {
+            book_side.add_qty(price, 1);
+        }
+        book_side.add_qty(1, 5);
+        assert_eq!(book_side.top_n_prices().len(), TOP_N_DEPTH);
+        assert!(!book_side.top_n_prices().contains(&1));
+        for price in 2..=(2 * TOP_N_DEPTH as u32) {
+            book_side.delete_qty(price, 1).unwrap();
+        }
+        assert_eq!(book_side.best_price, Some(1));
+        assert_eq!(book_side.best_price_qty, Some(6));
+    }
+
+    #[test]
+    fn test_best_price_matches_full_scan() {
+        for is_bid in vec![true, false] {
+            let mut book_side = BookSide::new(is_bid);
+            let mut seed = 12345u64;
+            for _ in 0..10_000 {
+                seed = seed.wrapping_mul(6364136223846793005).wrapping_add(1);
+                let price = ((seed >> 33) % 64) as u32;
+                let qty = ((seed >> 45) % 3 + 1) as u32;
+                match book_side.get_level(price).map(|l| l.qty) {
+                    Some(level_qty) if seed % 2 == 0 => {
+                        book_side.delete_qty(price, qty.min(level_qty)).unwrap()
+                    }
+                    _ => book_side.add_qty(price, qty),
+                }
+                let expected = if is_bid {
+                    book_side.levels.values().max_by_key(|l| l.price)
+                } else {
+                    book_side.levels.values().min_by_key(|l| l.price)
+                };
+                assert_eq!(book_side.best_price, expected.map(|l| l.price));
+                assert_eq!(book_side.best_price_qty, expected.map(|l| l.qty));
+            }
+        }
+    }
+
+    #[test]
+    fn test_add_zero_qty() {
+        let mut book_side: BookSide<u32, u32> = BookSide::new(true);
+        book_side.add_qty(100, 0);
+        assert!(book_side.get_level(100).is_none());
+        assert_eq!(book_side.best_price, None);
+        book_side.add_qty(99, 5);
+        book_side.add_qty(99, 0);
+        assert_eq!(book_side.get_level(99).unwrap().qty, 5);
+        assert_eq!(book_side.best_price_qty, Some(5));
+    }
+
+    #[test]
+    fn test_modify_qty_in_place() {
+        for is_bid in vec![true, false] {
+            let mut book_side = BookSide::new(is_bid);
+            book_side.add_qty(100, 10);
+            book_side.add_qty(101, 5);
+            book_side.modify_qty(100, 4, 7).unwrap();
+            assert_eq!(book_side.get_level(100).unwrap().qty, 13);
+            book_side.modify_qty(101, 5, 2).unwrap();
+            assert_eq!(book_side.get_level(101).unwrap().qty, 2);
+            let (best_price, best_qty) = if is_bid { (101, 2) } else { (100, 13) };
+            assert_eq!(book_side.best_price, Some(best_price));
+            assert_eq!(book_side.best_price_qty, Some(best_qty));
+
+            assert_eq!(
+                book_side.modify_qty(101, 3, 1),
+                Err(DeleteError::QtyExceedsAvailable)
+            );
+            assert_eq!(
+                book_side.modify_qty(102, 1, 1),
+                Err(DeleteError::LevelError(LevelError::LevelNotFound))
+            );
+
+            book_side.modify_qty(best_price, best_qty, 0).unwrap();
+            assert!(book_side.get_level(best_price).is_none());
+            assert_eq!(book_side.best_price, Some(201 - best_price));
+        }
+    }
+
     #[test]
     fn test_modify_price() {
         let mut book_side = BookSide::new(true);
@@ -0,0 +1,183 @@
+use std::fmt::Debug;
+
+use num::traits::Num;
+
+use super::book_side::{DeleteError, LevelError};
+
+/// Book side for prices known to fall within a small window.
+///
+/// Levels are addressed by their offset into the window rather than by price,
+/// and their quantities are stored in a flat array, so every mutation is an
+/// index into that array instead of a hash lookup. The caller maps prices to
+/// offsets, e.g. `price - min_price`. When the best level is deleted the next
+/// best is found by scanning the array towards worse prices, which is bounded
+/// by the size of the window.
+#[derive(Debug)]
+pub struct DenseBookSide<Qty> {
+    is_bid: bool,
+    qtys: Vec<Qty>,
+    best_idx: Option<usize>,
+}
+
+impl<Qty: Debug + Copy + Ord + Num> DenseBookSide<Qty> {
+    #[must_use]
+    pub fn new(is_bid: bool, num_levels: usize) -> Self {
+        DenseBookSide {
+            is_bid,
+            qtys: vec![Qty::zero(); num_levels],
+            best_idx: None,
+        }
+    }
+
+    #[inline]
+    pub fn is_bid(&self) -> bool {
+        self.is_bid
+    }
+
+    #[inline]
+    pub fn is_empty(&self) -> bool {
+        self.best_idx.is_none()
+    }
+
+    #[inline]
+    pub fn get_qty(&self, idx: usize) -> Qty {
+        self.qtys[idx]
+    }
+
+    /// Offset and qty of the best level, if there are any levels.
+    #[inline]
+    pub fn best(&self) -> Option<(usize, Qty)> {
+        self.best_idx.map(|idx| (idx, self.qtys[idx]))
+    }
+
+    /// Offset and qty of the best level, and whether the side has any levels.
+    /// An empty side reports offset 0 and zero qty, so callers writing into
+    /// columnar outputs can take the values and the validity in one read.
+    #[inline]
+    pub fn best_level(&self) -> (usize, Qty, bool) {
+        match self.best_idx {
+            Some(idx) => (idx, self.qtys[idx], true),
+            None => (0, Qty::zero(), false),
+        }
+    }
+
+    /// Adding zero qty is a no-op, so it never creates an empty level.
+    #[inline]
+    pub fn add_qty(&mut self, idx: usize, qty: Qty) {
+        if qty.is_zero() {
+            return;
+        }
+        self.qtys[idx] = self.qtys[idx] + qty;
+        let is_better = match self.best_idx {
+            Some(best_idx) => (idx > best_idx) == self.is_bid && idx != best_idx,
+            None => true,
+        };
+        if is_better {
+            self.best_idx = Some(idx);
+        }
+    }
+
+    #[inline]
+    pub fn delete_qty(&mut self, idx: usize, qty: Qty) -> Result<(), DeleteError> {
+        let level_qty = self.qtys[idx];
+        if level_qty.is_zero() {
+            return Err(LevelError::LevelNotFound.into());
+        }
+        if level_qty < qty {
+            return Err(DeleteError::QtyExceedsAvailable);
+        }
+        self.qtys[idx] = level_qty - qty;
+        if self.qtys[idx].is_zero() && self.best_idx == Some(idx) {
+            self.update_best_idx(idx);
+        }
+        Ok(())
+    }
+
+    /// Find the best remaining level after the best level at `deleted_idx` was
+    /// emptied. Every other level is worse, so only those need scanning.
+    #[inline]
+    fn update_best_idx(&mut self, deleted_idx: usize) {
+        let is_level = |idx: &usize| !self.qtys[*idx].is_zero();
+        self.best_idx = if self.is_bid {
+            (0..deleted_idx).rev().find(is_level)
+        } else {
+            (deleted_idx + 1..self.qtys.len()).find(is_level)
+        };
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_new() {
+        let book_side: DenseBookSide<i64> = DenseBookSide::new(true, 8);
+        assert!(book_side.is_empty());
+        assert_eq!(book_side.best(), None);
+        assert_eq!(book_side.best_level(), (0, 0, false));
+        assert_eq!(book_side.get_qty(7), 0);
+    }
+
+    #[test]
+    fn test_add_qty() {
+        let mut bids: DenseBookSide<i64> = DenseBookSide::new(true, 8);
+        bids.add_qty(2, 10);
+        bids.add_qty(5, 20);
+        bids.add_qty(3, 30);
+        bids.add_qty(5, 5);
+        assert_eq!(bids.best(), Some((5, 25)));
+        assert_eq!(bids.best_level(), (5, 25, true));
+
+        let mut asks: DenseBookSide<i64> = DenseBookSide::new(false, 8);
+        asks.add_qty(5, 20);
+        asks.add_qty(2, 10);
+        asks.add_qty(3, 30);
+        asks.add_qty(2, 5);
+        assert_eq!(asks.best(), Some((2, 15)));
+
+        let mut empty: DenseBookSide<i64> = DenseBookSide::new(true, 8);
+        empty.add_qty(4, 0);
+        assert!(empty.is_empty());
+    }
+
+    #[test]
+    fn test_delete_qty() {
+        for is_bid in [true, false] {
+            let mut book_side: DenseBookSide<i64> = DenseBookSide::new(is_bid, 8);
+            book_side.add_qty(1, 10);
+            book_side.add_qty(4, 20);
+            book_side.add_qty(6, 30);
+            let (best, second, worst) = if is_bid { (6, 4, 1) } else { (1, 4, 6) };
+
+            book_side.delete_qty(best, 5).unwrap();
+            assert_eq!(book_side.best(), Some((best, book_side.get_qty(best))));
+            book_side.delete_qty(best, book_side.get_qty(best)).unwrap();
+            assert_eq!(book_side.best(), Some((second, book_side.get_qty(second))));
+            book_side
+                .delete_qty(worst, book_side.get_qty(worst))
+                .unwrap();
+            assert_eq!(book_side.best(), Some((second, book_side.get_qty(second))));
+            book_side
+                .delete_qty(second, book_side.get_qty(second))
+                .unwrap();
+            assert_eq!(book_side.best(), None);
+            assert!(book_side.is_empty());
+        }
+    }
+
+    #[test]
+    fn test_delete_qty_errors() {
+        let mut book_side: DenseBookSide<i64> = DenseBookSide::new(true, 8);
+        book_side.add_qty(3, 10);
+        assert_eq!(
+            book_side.delete_qty(2, 1),
+            Err(DeleteError::LevelError(LevelError::LevelNotFound))
+        );
+        assert_eq!(
+            book_side.delete_qty(3, 11),
+            Err(DeleteError::QtyExceedsAvailable)
+        );
+        assert_eq!(book_side.get_qty(3), 10);
+    }
+}
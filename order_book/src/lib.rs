@@ -1,3 +1,5 @@
 pub mod book_side;
+pub mod dense_book_side;
 pub mod order_book;
 mod price_level;
+mod tracker;
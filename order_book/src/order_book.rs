@@ -6,9 +6,10 @@ use num::traits::Num;
 
 use crate::book_side::BookSide;
 
+/// Book sides are indexed by `is_bid as usize`: offers at 0 and bids at 1, so
+/// picking a side is a data-dependent load rather than a branch on `is_bid`.
 pub struct OrderBook<Price, Qty> {
-    bids: BookSide<Price, Qty>,
-    offers: BookSide<Price, Qty>,
+    sides: [BookSide<Price, Qty>; 2],
 }
 
 impl<Price: Copy + Debug + Display + Hash + Ord, Qty: Copy + Debug + Display + Num + Ord> Default
@@ -24,24 +25,22 @@ impl<Price: Copy + Debug + Display + Hash + Ord, Qty: Copy + Debug + Display + N
 {
     pub fn new() -> Self {
         OrderBook {
-            bids: BookSide::new(true),
-            offers: BookSide::new(false),
+            sides: [BookSide::new(false), BookSide::new(true)],
         }
     }
 
     #[inline]
     pub fn book_side(&mut self, is_bid: bool) -> &mut BookSide<Price, Qty> {
-        if is_bid {
-            &mut self.bids
-        } else {
-            &mut self.offers
-        }
+        &mut self.sides[is_bid as usize]
     }
 
     pub fn add_qty(&mut self, is_bid: bool, price: Price, qty: Qty) {
         self.book_side(is_bid).add_qty(price, qty)
     }
 
+    /// Move `prev_qty` at `prev_price` to `new_qty` at `new_price`. A modify to
+    /// zero qty removes the order and, like adding zero qty, never leaves an
+    /// empty level behind, whether or not the price changes.
     pub fn modify_qty(
         &mut self,
         is_bid: bool,
@@ -50,8 +49,20 @@ impl<Price: Copy + Debug + Display + Hash + Ord, Qty: Copy + Debug + Display + N
         new_price: Price,
         new_qty: Qty,
     ) {
-        self.delete_qty(is_bid, prev_price, prev_qty);
-        self.add_qty(is_bid, new_price, new_qty);
+        if prev_price == new_price {
+            self.book_side(is_bid)
+                .modify_qty(new_price, prev_qty, new_qty)
+                .with_context(|| {
+                    format!(
+                        "Failed to modify qty at price level: is_bid: {}, price: {}, prev_qty: {}, new_qty: {}",
+                        is_bid, new_price, prev_qty, new_qty
+                    )
+                })
+                .unwrap();
+        } else {
+            self.delete_qty(is_bid, prev_price, prev_qty);
+            self.add_qty(is_bid, new_price, new_qty);
+        }
     }
 
     pub fn delete_qty(&mut self, is_bid: bool, price: Price, qty: Qty) {
@@ -87,6 +98,16 @@ mod tests {
         }
     }
 
+    #[test]
+    fn test_book_side_dispatch() {
+        let mut order_book: OrderBook<i64, i64> = OrderBook::default();
+        assert!(order_book.book_side(true).is_bid());
+        assert!(!order_book.book_side(false).is_bid());
+        order_book.add_qty(true, 100, 10);
+        assert_eq!(order_book.book_side(true).best_price, Some(100));
+        assert_eq!(order_book.book_side(false).best_price, None);
+    }
+
     #[test]
     fn test_cancel_order() {
         let mut order_book = OrderBook::default();
@@ -126,4 +147,21 @@ mod tests {
             assert_eq!(order_book.book_side(is_bid).get_level(1).unwrap().qty, 1);
         }
     }
+
+    #[test]
+    fn test_modify_to_zero_qty() {
+        for is_bid in [true, false] {
+            let mut order_book = OrderBook::default();
+            order_book.add_qty(is_bid, 2, 5);
+            order_book.modify_qty(is_bid, 2, 5, 2, 0);
+            assert!(order_book.book_side(is_bid).get_level(2).is_none());
+            assert_eq!(order_book.book_side(is_bid).best_price, None);
+
+            order_book.add_qty(is_bid, 2, 5);
+            order_book.modify_qty(is_bid, 2, 5, 3, 0);
+            assert!(order_book.book_side(is_bid).get_level(2).is_none());
+            assert!(order_book.book_side(is_bid).get_level(3).is_none());
+            assert_eq!(order_book.book_side(is_bid).best_price, None);
+        }
+    }
 }
@@ -1,72 +1,178 @@
-use crate::book_side::BookSide;
-use crate::price_level::PriceLevel;
+use std::cmp::Ordering;
+use std::fmt::Debug;
 
-/// Trait for book side operations with top N tracking.
+/// Contiguous, sorted window over the best N price levels of one book side.
 ///
-/// TopNLevels is an array of Option<PriceLevel> with length N.
-/// with None representing that there are less than N levels in
-/// total. The array is sorted from best to worst price level.
-/// The array is updated on every add_qty and delete_qty operation.
+/// Prices and quantities are stored in two separate buffers ordered from best
+/// to worst price, so reading the top of book or locating a resident level is a
+/// search over a few contiguous cache lines rather than a walk over the level
+/// map. The window never holds more than N levels.
 ///
-/// ??? Should probably track the other prices too, so it's easy to
-/// insert the N'th level after deleting one of the top N.
-///
-/// Adding a new level to top N is easy, just check if the new level
-/// is better than the worst level in top N, if it is, replace the
-/// worst level.
-///
-/// ??? BookSideOpsWithTopNTracking ... do I need ths or just BookSideOps
-/// implemented on different structs (BookSide and BookSideWithTopNTracking)?
+/// The window is a cache of the owning `BookSide`, which keeps every level in
+/// its map. The invariant maintained by the owner is that every level which is
+/// not resident in the window is worse than every level which is. Deletes
+/// therefore only shrink the window, and the owner needs to rescan its map to
+/// refill the window only once it has been emptied.
+#[derive(Debug)]
+pub struct TopNLevels<Price, Qty, const N: usize> {
+    is_bid: bool,
+    prices: Vec<Price>,
+    qtys: Vec<Qty>,
+}
 
-trait BookSideOps<Price, Qty, const N: usize> {
-    fn add_qty(&mut self, price: Price, qty: Qty);
-    fn modify_qty(&mut self, price: Price, qty: Qty, prev_price: Price, prev_qty: Qty) {
-        self.delete_qty(prev_price, prev_qty);
-        self.add_qty(price, qty);
+impl<Price: Debug + Copy + Ord, Qty: Debug + Copy, const N: usize> TopNLevels<Price, Qty, N> {
+    #[must_use]
+    pub fn new(is_bid: bool) -> Self {
+        TopNLevels {
+            is_bid,
+            prices: Vec::with_capacity(N),
+            qtys: Vec::with_capacity(N),
+        }
     }
-    fn delete_qty(&mut self, price: Price, qty: Qty);
-    fn top_n(&self) -> &TopNLevels<Price, Qty, N>;
-}
 
-struct BookSideWithTopNTracking<Price, Qty, const N: usize> {
-    book_side: BookSide<Price, Qty>,
-    top_n_levels: TopNLevels<Price, Qty, N>,
-}
+    #[inline]
+    pub fn len(&self) -> usize {
+        self.prices.len()
+    }
 
-struct NLevels<Price, Qty, const N: usize> {
-    levels: [Option<PriceLevel<Price, Qty>>; N],
-}
+    #[inline]
+    pub fn is_empty(&self) -> bool {
+        self.prices.is_empty()
+    }
 
-enum TopNLevels<Price, Qty, const N: usize> {
-    Bids(NLevels<Price, Qty, N>),
-    Asks(NLevels<Price, Qty, N>),
-}
+    #[inline]
+    pub fn prices(&self) -> &[Price] {
+        &self.prices
+    }
 
-impl<Price, Qty, const N: usize> TopNLevels<Price, Qty, N> {
-    fn new(is_bid: bool) -> Self {
-        TopNLevels {
-            is_bid,
-            levels: core::array::from_fn(|_| None), // Avoids PriceLevel requiring Copy trait
+    #[inline]
+    pub fn qtys(&self) -> &[Qty] {
+        &self.qtys
+    }
+
+    #[inline]
+    pub fn best(&self) -> Option<(Price, Qty)> {
+        Some((*self.prices.first()?, *self.qtys.first()?))
+    }
+
+    /// Order prices from best to worst: descending for bids, ascending for asks.
+    #[inline]
+    fn cmp_prices(&self, a: Price, b: Price) -> Ordering {
+        if self.is_bid {
+            b.cmp(&a)
+        } else {
+            a.cmp(&b)
         }
     }
-}
 
-impl<Price, Qty, const N: usize> TopNLevels<Price, Qty, N>::Bids {
-    fn maybe_add_level(&mut self, level: PriceLevel<Price, Qty>) {
-        // 1) if space, add level
-        // 2) else if level is better than worst level, replace worst level
-        // 3) else do nothing
-        // 4) if added something, then sort levels
-        todo!()
+    /// Find the index of a resident price, or the index at which it would be
+    /// inserted to keep the window sorted.
+    #[inline]
+    pub fn find(&self, price: Price) -> Result<usize, usize> {
+        self.prices
+            .binary_search_by(|resident| self.cmp_prices(*resident, price))
+    }
+
+    #[inline]
+    pub fn set_qty(&mut self, idx: usize, qty: Qty) {
+        self.qtys[idx] = qty;
     }
 
-    fn maybe_delete_level(&mut self, level: PriceLevel<Price, Qty>) {
-        // Performance Idea: finding next level to insert may be a bottleneck, might it be a good
-        // hueristic to maintain a longer list of levels than N so that we only need to find the
-        // next level if several deletes happen consecutively on top of book? In typical order books
-        // there are more frequent changes to top of book than deeper in the book.
-        todo!()
+    /// Insert a level at `idx`, evicting the worst level if the window is full.
+    /// Levels which would land beyond the end of a full window are ignored.
+    #[inline]
+    pub fn insert(&mut self, idx: usize, price: Price, qty: Qty) {
+        if idx >= N {
+            return;
+        }
+        if self.prices.len() == N {
+            self.prices.pop();
+            self.qtys.pop();
+        }
+        self.prices.insert(idx, price);
+        self.qtys.insert(idx, qty);
+    }
+
+    #[inline]
+    pub fn remove(&mut self, idx: usize) {
+        self.prices.remove(idx);
+        self.qtys.remove(idx);
+    }
+
+    /// Rebuild the window from scratch with the best N of the given levels.
+    pub fn refill(&mut self, levels: impl Iterator<Item = (Price, Qty)>) {
+        self.prices.clear();
+        self.qtys.clear();
+        for (price, qty) in levels {
+            if let Err(idx) = self.find(price) {
+                self.insert(idx, price, qty);
+            }
+        }
     }
 }
 
-impl<Price, Qty, const N: usize> TopNLevels<Price, Qty, N>::Asks {}
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    fn insert_all<const N: usize>(top_n: &mut TopNLevels<u32, u32, N>, prices: &[u32]) {
+        for &price in prices {
+            if let Err(idx) = top_n.find(price) {
+                top_n.insert(idx, price, price * 10);
+            }
+        }
+    }
+
+    #[test]
+    fn test_new() {
+        let top_n: TopNLevels<u32, u32, 4> = TopNLevels::new(true);
+        assert!(top_n.is_empty());
+        assert_eq!(top_n.best(), None);
+    }
+
+    #[test]
+    fn test_insert_sorts_best_to_worst() {
+        let mut bids: TopNLevels<u32, u32, 4> = TopNLevels::new(true);
+        insert_all(&mut bids, &[2, 5, 1, 3]);
+        assert_eq!(bids.prices(), &[5, 3, 2, 1]);
+        assert_eq!(bids.qtys(), &[50, 30, 20, 10]);
+        assert_eq!(bids.best(), Some((5, 50)));
+
+        let mut asks: TopNLevels<u32, u32, 4> = TopNLevels::new(false);
+        insert_all(&mut asks, &[2, 5, 1, 3]);
+        assert_eq!(asks.prices(), &[1, 2, 3, 5]);
+        assert_eq!(asks.best(), Some((1, 10)));
+    }
+
+    #[test]
+    fn test_insert_evicts_worst_when_full() {
+        let mut bids: TopNLevels<u32, u32, 3> = TopNLevels::new(true);
+        insert_all(&mut bids, &[1, 2, 3]);
+        insert_all(&mut bids, &[4]);
+        assert_eq!(bids.prices(), &[4, 3, 2]);
+        insert_all(&mut bids, &[0]);
+        assert_eq!(bids.prices(), &[4, 3, 2]);
+    }
+
+    #[test]
+    fn test_find_and_remove() {
+        let mut asks: TopNLevels<u32, u32, 4> = TopNLevels::new(false);
+        insert_all(&mut asks, &[3, 1, 2]);
+        assert_eq!(asks.find(2), Ok(1));
+        assert_eq!(asks.find(4), Err(3));
+        asks.remove(0);
+        assert_eq!(asks.prices(), &[2, 3]);
+        asks.set_qty(1, 7);
+        assert_eq!(asks.qtys(), &[20, 7]);
+    }
+
+    #[test]
+    fn test_refill() {
+        let mut bids: TopNLevels<u32, u32, 2> = TopNLevels::new(true);
+        bids.refill([(1, 10), (4, 40), (3, 30), (2, 20)].into_iter());
+        assert_eq!(bids.prices(), &[4, 3]);
+        assert_eq!(bids.qtys(), &[40, 30]);
+        bids.refill(std::iter::empty());
+        assert!(bids.is_empty());
+    }
+}
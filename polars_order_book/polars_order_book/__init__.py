@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import functools
+import warnings
 from pathlib import Path
 from typing import TYPE_CHECKING
 
@@ -13,7 +15,11 @@ if TYPE_CHECKING:
 if parse_version(pl.__version__) < parse_version("0.20.16"):
     from polars.utils.udfs import _get_shared_lib_location
 
-    lib: str | Path = _get_shared_lib_location(__file__)
+    try:
+        lib: str | Path | None = _get_shared_lib_location(__file__)
+    except StopIteration:
+        # No compiled library next to the package, so `calculate_bbo` falls back.
+        lib = None
 else:
     lib = Path(__file__).parent
 
@@ -24,25 +30,87 @@ def calculate_bbo(
     is_bid: IntoExpr,
     prev_price: IntoExpr | None = None,
     prev_qty: IntoExpr | None = None,
+    by: IntoExpr | list[IntoExpr] | None = None,
 ) -> pl.Expr:
-    price = parse_into_expr(price)
-    qty = parse_into_expr(qty)
-    is_bid = parse_into_expr(is_bid)
-    if (prev_price is not None) and (prev_qty is not None):
-        prev_price = parse_into_expr(prev_price)
-        prev_qty = parse_into_expr(prev_qty)
-        args = [price, qty, is_bid, prev_price, prev_qty]
-    elif (prev_price is None) and (prev_qty is None):
-        args = [price, qty, is_bid]
-    else:
+    if (prev_price is None) != (prev_qty is None):
         raise ValueError(
             f"""Cannot provide only one of prev_price and prev_qty. Got:\n
             prev_price={prev_price},\nprev_qty={prev_qty}"""
         )
+    inputs = [price, qty, is_bid]
+    # All-null literal prev columns, e.g. `pl.lit(None)`, carry no previous
+    # levels, so use the plain add/delete kernel rather than materializing them.
+    if not (_is_null_literal(prev_price) and _is_null_literal(prev_qty)):
+        inputs += [prev_price, prev_qty]
+
+    if all(isinstance(arg, str) for arg in inputs):
+        bbo = _calculate_bbo_from_names(tuple(inputs))  # type: ignore
+    else:
+        bbo = _calculate_bbo_expr([parse_into_expr(arg) for arg in inputs])  # type: ignore
+
+    # One independent book per group, e.g. per instrument, which polars can
+    # evaluate for all groups in parallel.
+    return bbo if by is None else bbo.over(by)
+
+
+def _is_null_literal(arg: IntoExpr | None) -> bool:
+    # Only scalar literals such as `pl.lit(None, dtype=pl.Int64)` count; Series
+    # literals are skipped without being evaluated where polars can tell them
+    # apart, and anything longer than one row is never treated as null.
+    if arg is None:
+        return True
+    if not isinstance(arg, pl.Expr) or not arg.meta.is_literal(allow_aliasing=True):
+        return False
+    if hasattr(arg.meta, "is_scalar") and not arg.meta.is_scalar():
+        return False
+    value = pl.select(arg).to_series()
+    return value.len() == 1 and value.null_count() == 1
+
+
+@functools.lru_cache(maxsize=128)
+def _calculate_bbo_from_names(names: tuple[str, ...]) -> pl.Expr:
+    # Expressions are immutable, so the expression built for plain column names
+    # can be shared between calls instead of being registered again each time.
+    return _calculate_bbo_expr([pl.col(name) for name in names])
+
+
+def _calculate_bbo_expr(args: list[pl.Expr]) -> pl.Expr:
+    if lib is not None:
+        try:
+            return register_plugin(
+                args=args,  # type: ignore
+                symbol="pl_calculate_bbo",
+                is_elementwise=False,
+                lib=lib,
+            )
+        except FileNotFoundError:
+            pass
 
-    return register_plugin(
-        args=args,  # type: ignore
-        symbol="pl_calculate_bbo",
-        is_elementwise=False,
-        lib=lib,
+    # The compiled plugin is missing, e.g. in a source checkout without a build.
+    warnings.warn(
+        "polars_order_book could not find its compiled plugin and is falling back "
+        "to a much slower Python implementation. Build the package, e.g. with "
+        "`maturin develop`, to use the plugin.",
+        stacklevel=3,
     )
+    from polars_order_book._numba_fallback import calculate_bbo_fallback
+
+    return calculate_bbo_fallback(args)
+
+
+def calculate_bbo_columns(
+    price: IntoExpr,
+    qty: IntoExpr,
+    is_bid: IntoExpr,
+    prev_price: IntoExpr | None = None,
+    prev_qty: IntoExpr | None = None,
+    by: IntoExpr | list[IntoExpr] | None = None,
+) -> pl.Expr:
+    """
+    Like `calculate_bbo`, but expand the result into its four columns.
+
+    The book is replayed once and the struct fields are unnested within the
+    expression, which avoids materializing a `bbo` struct column only to unnest
+    it from the frame afterwards.
+    """
+    return calculate_bbo(price, qty, is_bid, prev_price, prev_qty, by).struct.unnest()
@@ -0,0 +1,173 @@
+"""
+Pure Python implementation of `calculate_bbo`, used when the compiled plugin is missing.
+
+The kernel is compiled with numba when it is installed and otherwise runs as plain
+Python, so it is always available but only fast with numba.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Callable
+from typing import Any
+
+import numpy as np
+import polars as pl
+
+try:
+    from numba import njit
+except ImportError:
+
+    def njit(*args: Any, **kwargs: Any) -> Callable[[Callable], Callable]:  # type: ignore[no-redef]
+        def decorator(func: Callable) -> Callable:
+            return func
+
+        return decorator
+
+
+BBO_FIELDS = ["best_bid", "best_bid_qty", "best_ask", "best_ask_qty"]
+INPUT_NAMES = ["price", "qty", "is_bid", "prev_price", "prev_qty"]
+
+
+@njit(cache=True)
+def _best_price(levels: dict, is_bid: bool) -> tuple[int, bool]:
+    has_best = False
+    best = 0
+    for price in levels:
+        if not has_best or (price > best if is_bid else price < best):
+            best = price
+            has_best = True
+    return best, has_best
+
+
+@njit(cache=True)
+def _add_qty(levels, best, has_best, side, price, qty):  # type: ignore[no-untyped-def]
+    # Adding zero qty never creates an empty level, as in the Rust book.
+    if qty == 0:
+        return
+    levels[price] = levels.get(price, 0) + qty
+    if not has_best[side] or (price > best[side] if side == 1 else price < best[side]):
+        best[side] = price
+        has_best[side] = True
+
+
+@njit(cache=True)
+def _delete_qty(levels, best, has_best, side, price, qty):  # type: ignore[no-untyped-def]
+    if price not in levels:
+        raise ValueError("Invalid delete qty operation - level not found")
+    level_qty = levels[price]
+    if qty > level_qty:
+        raise ValueError(
+            "Invalid delete qty operation - likely deleted more than available qty"
+        )
+    if qty == level_qty:
+        del levels[price]
+        if price == best[side]:
+            best[side], has_best[side] = _best_price(levels, side == 1)
+    else:
+        levels[price] = level_qty - qty
+
+
+@njit(cache=True)
+def bbo_kernel(  # type: ignore[no-untyped-def]
+    price,
+    qty,
+    is_bid,
+    prev_price,
+    prev_price_valid,
+    prev_qty,
+    prev_qty_valid,
+    out_price,
+    out_qty,
+    out_valid,
+):
+    """
+    Replay price-level mutations and write the best level of each side per row.
+
+    Outputs are `(2, n)` arrays indexed by side, with asks at 0 and bids at 1.
+    """
+    # Seed then clear the dicts so numba can infer their int64 -> int64 types.
+    asks = {0: 0}
+    bids = {0: 0}
+    asks.clear()
+    bids.clear()
+    best = np.zeros(2, dtype=np.int64)
+    has_best = np.zeros(2, dtype=np.bool_)
+    for i in range(price.shape[0]):
+        side = 1 if is_bid[i] else 0
+        levels = bids if side == 1 else asks
+        if prev_price_valid[i]:
+            if not prev_qty_valid[i]:
+                raise ValueError("Invalid input: prev_price given without prev_qty")
+            _delete_qty(levels, best, has_best, side, prev_price[i], prev_qty[i])
+            _add_qty(levels, best, has_best, side, price[i], qty[i])
+        else:
+            delta = qty[i] - prev_qty[i] if prev_qty_valid[i] else qty[i]
+            if delta > 0:
+                _add_qty(levels, best, has_best, side, price[i], delta)
+            else:
+                _delete_qty(levels, best, has_best, side, price[i], -delta)
+        for s in range(2):
+            out_valid[s, i] = has_best[s]
+            if has_best[s]:
+                out_price[s, i] = best[s]
+                out_qty[s, i] = (bids if s == 1 else asks)[best[s]]
+
+
+def _masked(
+    name: str, values: np.ndarray, valid: np.ndarray, dtype: pl.DataType
+) -> pl.Series:
+    series = pl.Series(name, values).set(pl.Series(~valid), None)  # type: ignore[arg-type]
+    return series.cast(dtype)
+
+
+def _calculate_bbo_batch(inputs: pl.Series) -> pl.Series:
+    columns = inputs.struct.unnest()
+    n = columns.height
+    price_dtype, qty_dtype = columns["price"].dtype, columns["qty"].dtype
+    price = columns["price"].cast(pl.Int64).to_numpy()
+    qty = columns["qty"].cast(pl.Int64).to_numpy()
+    is_bid = columns["is_bid"].to_numpy()
+    if "prev_price" in columns.columns:
+        prev_price, prev_qty = columns["prev_price"], columns["prev_qty"]
+    else:
+        prev_price = prev_qty = pl.Series(values=[None] * n, dtype=pl.Int64)
+    out_price = np.zeros((2, n), dtype=np.int64)
+    out_qty = np.zeros((2, n), dtype=np.int64)
+    out_valid = np.zeros((2, n), dtype=np.bool_)
+    bbo_kernel(
+        price,
+        qty,
+        is_bid,
+        prev_price.cast(pl.Int64).fill_null(0).to_numpy(),
+        prev_price.is_not_null().to_numpy(),
+        prev_qty.cast(pl.Int64).fill_null(0).to_numpy(),
+        prev_qty.is_not_null().to_numpy(),
+        out_price,
+        out_qty,
+        out_valid,
+    )
+    return pl.DataFrame(
+        [
+            _masked("best_bid", out_price[1], out_valid[1], price_dtype),
+            _masked("best_bid_qty", out_qty[1], out_valid[1], qty_dtype),
+            _masked("best_ask", out_price[0], out_valid[0], price_dtype),
+            _masked("best_ask_qty", out_qty[0], out_valid[0], qty_dtype),
+        ]
+    ).to_struct("bbo")
+
+
+def calculate_bbo_fallback(args: list[pl.Expr]) -> pl.Expr:
+    """Build the `calculate_bbo` expression on top of the Python kernel."""
+    inputs = pl.struct([arg.alias(name) for name, arg in zip(INPUT_NAMES, args)])
+    # As in the plugin, the price and qty fields keep the dtypes of the price and
+    # qty inputs. Without dtype expressions the output schema is left to polars.
+    price, qty = args[0], args[1]
+    fields = [price, qty, price, qty]
+    return_dtype = (
+        pl.dtype_of(pl.struct([arg.alias(f) for f, arg in zip(BBO_FIELDS, fields)]))
+        if hasattr(pl, "dtype_of")
+        else None
+    )
+    return inputs.map_batches(_calculate_bbo_batch, return_dtype=return_dtype).alias(
+        "bbo"
+    )
@@ -11,6 +11,20 @@ if TYPE_CHECKING:
     from polars.type_aliases import IntoExpr, PolarsDataType
 
 
+def parse_version(version: Sequence[str | int]) -> tuple[int, ...]:
+    # Simple version parser; split into a tuple of ints for comparison.
+    # vendored from Polars
+    if isinstance(version, str):
+        version = version.split(".")
+    return tuple(int(re.sub(r"\D", "", str(v))) for v in version)
+
+
+# Resolved once at import rather than on every expression construction.
+_USE_LEGACY_PLUGIN_API = parse_version(pl.__version__) < parse_version("0.20.16")
+if not _USE_LEGACY_PLUGIN_API:
+    from polars.plugins import register_plugin_function
+
+
 def parse_into_expr(
     expr: IntoExpr,
     *,
@@ -59,7 +73,7 @@ def register_plugin(
     args: list[IntoExpr],
     lib: str | Path,
 ) -> pl.Expr:
-    if parse_version(pl.__version__) < parse_version("0.20.16"):
+    if _USE_LEGACY_PLUGIN_API:
         assert isinstance(args[0], pl.Expr)
         assert isinstance(lib, str)
         return args[0].register_plugin(
@@ -69,8 +83,6 @@ def register_plugin(
             kwargs=kwargs,
             is_elementwise=is_elementwise,
         )
-    from polars.plugins import register_plugin_function
-
     return register_plugin_function(
         args=args,
         plugin_path=lib,
@@ -78,11 +90,3 @@ def register_plugin(
         kwargs=kwargs,
         is_elementwise=is_elementwise,
     )
-
-
-def parse_version(version: Sequence[str | int]) -> tuple[int, ...]:
-    # Simple version parser; split into a tuple of ints for comparison.
-    # vendored from Polars
-    if isinstance(version, str):
-        version = version.split(".")
-    return tuple(int(re.sub(r"\D", "", str(v))) for v in version)
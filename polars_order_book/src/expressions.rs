@@ -1,11 +1,39 @@
 #![allow(clippy::unused_unit)]
 
+use std::fmt::{Debug, Display};
+use std::hash::Hash;
+
+use hashbrown::HashMap;
 use itertools::izip;
-use polars::datatypes::BooleanType;
+use num::traits::{NumCast, PrimInt, Signed};
+use polars::export::arrow::array::{Array, PrimitiveArray};
+use polars::export::arrow::bitmap::Bitmap;
+use polars::export::arrow::types::NativeType;
 use polars::prelude::*;
+use polars_core::POOL;
 use pyo3_polars::derive::polars_expr;
+use rayon::prelude::*;
+
+use order_book::{book_side::BookSide, dense_book_side::DenseBookSide, order_book::OrderBook};
+
+/// Native types the kernels accept for price columns.
+trait PriceType: NativeType + Debug + Display + Hash + PrimInt {}
+impl<T: NativeType + Debug + Display + Hash + PrimInt> PriceType for T {}
+
+/// Native types the kernels accept for qty columns.
+trait QtyType: NativeType + Debug + Display + Ord + Signed {}
+impl<T: NativeType + Debug + Display + Ord + Signed> QtyType for T {}
+
+/// Rows per chunk when replaying simple mutations in parallel. A multiple of 64,
+/// so every chunk but the last fills whole validity words.
+const PARALLEL_CHUNK_LEN: usize = 1 << 16;
+
+/// Largest number of distinct price ticks for which the books are kept in flat
+/// arrays indexed by price instead of hash maps.
+const DENSE_PRICE_WINDOW: usize = 4096;
 
-use order_book::{book_side::BookSide, order_book::OrderBook};
+/// Net qty per price level of each side, offers at 0 and bids at 1.
+type NetLevels<Price, Qty> = [HashMap<Price, Qty>; 2];
 
 fn bbo_struct(input_fields: &[Field]) -> PolarsResult<Field> {
     let price_field = &input_fields[0];
@@ -38,19 +66,66 @@ fn _pl_calculate_bbo(inputs: &[Series]) -> PolarsResult<Series> {
         }
     }
 
-    let price = inputs[0].i64()?;
-    let qty = inputs[1].i64()?;
-    let is_bid = inputs[2].bool()?;
+    for input in &inputs[..3] {
+        polars_ensure!(
+            input.null_count() == 0,
+            ComputeError: "column '{}' must not contain nulls", input.name()
+        );
+    }
+    // Narrower integer columns halve the bytes the kernels stream through, so
+    // each supported price and qty dtype gets its own monomorphized kernel.
+    match (inputs[0].dtype(), inputs[1].dtype()) {
+        (DataType::Int32, DataType::Int32) => calculate_bbo::<Int32Type, Int32Type>(inputs),
+        (DataType::Int32, DataType::Int64) => calculate_bbo::<Int32Type, Int64Type>(inputs),
+        (DataType::Int64, DataType::Int32) => calculate_bbo::<Int64Type, Int32Type>(inputs),
+        (DataType::Int64, DataType::Int64) => calculate_bbo::<Int64Type, Int64Type>(inputs),
+        (price_dtype, qty_dtype) => polars_bail!(
+            InvalidOperation: "price and qty must be Int32 or Int64, got {} and {}",
+            price_dtype, qty_dtype
+        ),
+    }
+}
+
+fn calculate_bbo<P, Q>(inputs: &[Series]) -> PolarsResult<Series>
+where
+    P: PolarsNumericType,
+    Q: PolarsNumericType,
+    P::Native: PriceType,
+    Q::Native: QtyType,
+{
+    let price = inputs[0].unpack::<P>()?.rechunk();
+    let qty = inputs[1].unpack::<Q>()?.rechunk();
+    let is_bid = contiguous_bitmap(inputs[2].bool()?);
     let prev_price = inputs.get(3);
     let prev_qty = inputs.get(4);
 
     match (prev_price, prev_qty) {
+        // Without any previous levels every row is a plain add or delete, so skip
+        // modify handling altogether.
+        (Some(prev_price), Some(prev_qty))
+            if prev_price.null_count() == prev_price.len()
+                && prev_qty.null_count() == prev_qty.len() =>
+        {
+            calculate_bbo_from_simple_mutations(price.cont_slice()?, qty.cont_slice()?, &is_bid)
+        }
         (Some(prev_price), Some(prev_qty)) => {
-            let prev_price_chunked = prev_price.i64()?;
-            let prev_qty_chunked = prev_qty.i64()?;
-            calculate_bbo_with_modifies(price, qty, is_bid, prev_price_chunked, prev_qty_chunked)
+            // The prev columns may have a different integer width to price and
+            // qty, e.g. Int64 literals alongside Int32 columns.
+            let prev_price = prev_price.strict_cast(price.dtype())?;
+            let prev_price = prev_price.unpack::<P>()?.rechunk();
+            let prev_qty = prev_qty.strict_cast(qty.dtype())?;
+            let prev_qty = prev_qty.unpack::<Q>()?.rechunk();
+            calculate_bbo_with_modifies(
+                price.cont_slice()?,
+                qty.cont_slice()?,
+                &is_bid,
+                contiguous_array(&prev_price),
+                contiguous_array(&prev_qty),
+            )
+        }
+        (None, None) => {
+            calculate_bbo_from_simple_mutations(price.cont_slice()?, qty.cont_slice()?, &is_bid)
         }
-        (None, None) => calculate_bbo_from_simple_mutations(price, qty, is_bid),
         _ => panic!(
             "Expected both prev_price and prev_qty or neither, got: {:?} and {:?}",
             prev_price, prev_qty
@@ -58,123 +133,360 @@ fn _pl_calculate_bbo(inputs: &[Series]) -> PolarsResult<Series> {
     }
 }
 
+/// The values of a boolean column as a single bitmap, ignoring validity.
+fn contiguous_bitmap(ca: &BooleanChunked) -> Bitmap {
+    ca.rechunk()
+        .downcast_iter()
+        .next()
+        .map(|arr| arr.values().clone())
+        .unwrap_or_default()
+}
+
+/// The single arrow array backing a rechunked integer column.
+fn contiguous_array<T: PolarsNumericType>(ca: &ChunkedArray<T>) -> &PrimitiveArray<T::Native> {
+    ca.downcast_iter()
+        .next()
+        .expect("Rechunked column should have exactly one chunk")
+}
+
+/// The validity of an array as a bitmap, with every bit set if it has no nulls.
+fn validity_bitmap<T: NativeType>(arr: &PrimitiveArray<T>) -> Bitmap {
+    arr.validity()
+        .cloned()
+        .unwrap_or_else(|| Bitmap::new_with_value(true, arr.len()))
+}
+
 /// Calculate the best bid and best ask prices and quantities
 /// using price-point add and delete mutations.
-fn calculate_bbo_from_simple_mutations(
-    price_array: &ChunkedArray<Int64Type>,
-    qty_array: &ChunkedArray<Int64Type>,
-    is_bid_array: &ChunkedArray<BooleanType>,
+///
+/// The books are dense arrays when the prices span a small enough window, in
+/// which case long inputs are replayed in parallel chunks on polars' thread
+/// pool whenever it has more than one thread.
+fn calculate_bbo_from_simple_mutations<Price: PriceType, Qty: QtyType>(
+    price_array: &[Price],
+    qty_array: &[Qty],
+    is_bid_array: &Bitmap,
 ) -> PolarsResult<Series> {
+    if qty_array.iter().all(|qty| qty.is_positive()) {
+        return calculate_bbo_from_additions(price_array, qty_array, is_bid_array);
+    }
     let length = price_array.len();
-    let mut best_bid_builder: PrimitiveChunkedBuilder<Int64Type> =
-        PrimitiveChunkedBuilder::new("best_bid", length);
-    let mut best_bid_qty_builder: PrimitiveChunkedBuilder<Int64Type> =
-        PrimitiveChunkedBuilder::new("best_bid_qty", length);
-    let mut best_ask_builder: PrimitiveChunkedBuilder<Int64Type> =
-        PrimitiveChunkedBuilder::new("best_ask", length);
-    let mut best_ask_qty_builder: PrimitiveChunkedBuilder<Int64Type> =
-        PrimitiveChunkedBuilder::new("best_ask_qty", length);
-
-    let mut book: OrderBook<i64, i64> = OrderBook::default();
-    for tuple in izip!(
-        is_bid_array.into_iter(),
-        price_array.into_iter(),
-        qty_array.into_iter()
-    ) {
-        if let (Some(is_bid), Some(price), Some(qty)) = tuple {
-            apply_simple_mutation(&mut book, is_bid, price, qty);
+    let dense_window = dense_price_window(price_array);
+    if let Some((min_price, num_levels)) = dense_window {
+        // Only dense books go parallel: every chunk starts from a copy of the
+        // levels before it, which the dense window keeps small. Running on
+        // polars' pool rather than rayon's global one respects its configured
+        // thread count, e.g. `POLARS_MAX_THREADS`.
+        if length >= 4 * PARALLEL_CHUNK_LEN && POOL.current_num_threads() > 1 {
+            return POOL.install(|| {
+                calculate_bbo_from_simple_mutations_par(
+                    price_array,
+                    qty_array,
+                    is_bid_array,
+                    || DenseOrderBook::new(min_price, num_levels),
+                )
+            });
+        }
+    }
+    let rows = izip!(
+        is_bid_array.iter(),
+        price_array.iter().copied(),
+        qty_array.iter().copied()
+    );
+    let bbo = match dense_window {
+        Some((min_price, num_levels)) => {
+            replay_simple_mutations(DenseOrderBook::new(min_price, num_levels), rows, length)
+        }
+        None => replay_simple_mutations(OrderBook::default(), rows, length),
+    };
+    bbo.finish()
+}
+
+/// A book which add and delete mutations can be replayed on.
+trait SimpleMutationBook<Price, Qty> {
+    fn apply_simple_mutation(&mut self, is_bid: bool, price: Price, qty: Qty);
+
+    fn push_bbo(&mut self, bbo: &mut BboBuilder<Price, Qty>);
+}
+
+impl<Price: PriceType, Qty: QtyType> SimpleMutationBook<Price, Qty> for OrderBook<Price, Qty> {
+    #[inline]
+    fn apply_simple_mutation(&mut self, is_bid: bool, price: Price, qty: Qty) {
+        apply_simple_mutation(self, is_bid, price, qty)
+    }
+
+    #[inline]
+    fn push_bbo(&mut self, bbo: &mut BboBuilder<Price, Qty>) {
+        bbo.push_book(self)
+    }
+}
 
-            update_builders_one_side(
-                book.book_side(true),
-                &mut best_bid_builder,
-                &mut best_bid_qty_builder,
-            );
-
-            update_builders_one_side(
-                book.book_side(false),
-                &mut best_ask_builder,
-                &mut best_ask_qty_builder,
-            );
+/// Book for prices within `num_levels` ticks of `min_price`, with levels
+/// stored in flat arrays indexed by price offset instead of hash maps.
+struct DenseOrderBook<Price, Qty> {
+    min_price: Price,
+    // Offers at 0 and bids at 1, as in OrderBook.
+    sides: [DenseBookSide<Qty>; 2],
+}
+
+impl<Price: PriceType, Qty: QtyType> DenseOrderBook<Price, Qty> {
+    fn new(min_price: Price, num_levels: usize) -> Self {
+        DenseOrderBook {
+            min_price,
+            sides: [
+                DenseBookSide::new(false, num_levels),
+                DenseBookSide::new(true, num_levels),
+            ],
+        }
+    }
+
+    #[inline]
+    fn level_price(&self, idx: usize) -> Price {
+        self.min_price + <Price as NumCast>::from(idx).unwrap()
+    }
+}
+
+impl<Price: PriceType, Qty: QtyType> SimpleMutationBook<Price, Qty> for DenseOrderBook<Price, Qty> {
+    #[inline]
+    fn apply_simple_mutation(&mut self, is_bid: bool, price: Price, qty: Qty) {
+        let side = &mut self.sides[is_bid as usize];
+        let idx = (price - self.min_price).to_usize().unwrap();
+        if qty.is_positive() {
+            side.add_qty(idx, qty)
         } else {
-            panic!("Invalid input tuple: {:?}", tuple);
+            side.delete_qty(idx, qty.abs())
+                .expect("Invalid delete qty operation - likely deleted more than available qty")
         }
     }
-    let result = df!(
-        "best_bid"=>best_bid_builder.finish().into_series(),
-        "best_bid_qty"=>best_bid_qty_builder.finish().into_series(),
-        "best_ask"=>best_ask_builder.finish().into_series(),
-        "best_ask_qty"=>best_ask_qty_builder.finish().into_series()
-    )?
-    .into_struct("bbo")
-    .into_series();
-    Ok(result)
+
+    #[inline]
+    fn push_bbo(&mut self, bbo: &mut BboBuilder<Price, Qty>) {
+        let (bid_idx, bid_qty, has_bid) = self.sides[1].best_level();
+        bbo.push_bid(self.level_price(bid_idx), bid_qty, has_bid);
+        let (ask_idx, ask_qty, has_ask) = self.sides[0].best_level();
+        bbo.push_ask(self.level_price(ask_idx), ask_qty, has_ask);
+    }
 }
 
-/// Calculate the best bid and best ask prices and quantities
-/// using price-point mutations which may include modifies, i.e.
-/// a delete and an add operation in a single row.
-fn calculate_bbo_with_modifies(
-    price_array: &ChunkedArray<Int64Type>,
-    qty_array: &ChunkedArray<Int64Type>,
-    is_bid_array: &ChunkedArray<BooleanType>,
-    prev_price_array: &ChunkedArray<Int64Type>,
-    prev_qty_array: &ChunkedArray<Int64Type>,
-) -> PolarsResult<Series> {
+/// Replay add and delete mutations on `book`, recording the bbo after each row.
+fn replay_simple_mutations<Price: PriceType, Qty: QtyType>(
+    mut book: impl SimpleMutationBook<Price, Qty>,
+    rows: impl Iterator<Item = (bool, Price, Qty)>,
+    capacity: usize,
+) -> BboBuilder<Price, Qty> {
+    let mut bbo = BboBuilder::with_capacity(capacity);
+    for (is_bid, price, qty) in rows {
+        book.apply_simple_mutation(is_bid, price, qty);
+        book.push_bbo(&mut bbo);
+    }
+    bbo
+}
+
+/// The lowest price and the number of price ticks spanned by `price_array`, if
+/// it is at most `DENSE_PRICE_WINDOW`.
+fn dense_price_window<Price: PriceType>(price_array: &[Price]) -> Option<(Price, usize)> {
+    let min_price = *price_array.iter().min()?;
+    let max_price = *price_array.iter().max()?;
+    let span = max_price.to_i64()?.checked_sub(min_price.to_i64()?)?;
+    let num_levels = usize::try_from(span).ok()? + 1;
+    (num_levels <= DENSE_PRICE_WINDOW).then_some((min_price, num_levels))
+}
+
+/// Parallel version of `calculate_bbo_from_simple_mutations` for long inputs.
+///
+/// Every row adds a signed qty to a single price level, so the levels at the
+/// start of a chunk are the sum of the net changes of all chunks before it.
+/// The net changes are computed in parallel and prefix-summed, after which
+/// every chunk is replayed in parallel from its own starting book, created by
+/// `new_book`.
+fn calculate_bbo_from_simple_mutations_par<Price, Qty, Book>(
+    price_array: &[Price],
+    qty_array: &[Qty],
+    is_bid_array: &Bitmap,
+    new_book: impl Fn() -> Book + Sync,
+) -> PolarsResult<Series>
+where
+    Price: PriceType,
+    Qty: QtyType,
+    Book: SimpleMutationBook<Price, Qty>,
+{
     let length = price_array.len();
-    let mut best_bid_builder: PrimitiveChunkedBuilder<Int64Type> =
-        PrimitiveChunkedBuilder::new("best_bid", length);
-    let mut best_bid_qty_builder: PrimitiveChunkedBuilder<Int64Type> =
-        PrimitiveChunkedBuilder::new("best_bid_qty", length);
-    let mut best_ask_builder: PrimitiveChunkedBuilder<Int64Type> =
-        PrimitiveChunkedBuilder::new("best_ask", length);
-    let mut best_ask_qty_builder: PrimitiveChunkedBuilder<Int64Type> =
-        PrimitiveChunkedBuilder::new("best_ask_qty", length);
-
-    let mut book: OrderBook<i64, i64> = OrderBook::default();
-    for tuple in izip!(
-        is_bid_array.into_iter(),
-        price_array.into_iter(),
-        qty_array.into_iter(),
-        prev_price_array.into_iter(),
-        prev_qty_array.into_iter()
-    ) {
-        match tuple {
-            (Some(is_bid), Some(price), Some(qty), None, None) => {
-                apply_simple_mutation(&mut book, is_bid, price, qty);
+    let chunk_rows = |start: usize| {
+        let end = (start + PARALLEL_CHUNK_LEN).min(length);
+        (start..end).map(move |i| (is_bid_array.get_bit(i), price_array[i], qty_array[i]))
+    };
+    let chunk_starts: Vec<usize> = (0..length).step_by(PARALLEL_CHUNK_LEN).collect();
+
+    let net_changes: Vec<NetLevels<Price, Qty>> = chunk_starts
+        .par_iter()
+        .map(|&start| {
+            let mut changes: NetLevels<Price, Qty> = Default::default();
+            for (is_bid, price, qty) in chunk_rows(start) {
+                let level_qty = changes[is_bid as usize].entry(price).or_insert(Qty::zero());
+                *level_qty = *level_qty + qty;
             }
-            (Some(is_bid), Some(price), Some(qty), Some(prev_price), Some(prev_qty)) => {
-                book.modify_qty(is_bid, prev_price, prev_qty, price, qty)
+            changes
+        })
+        .collect();
+
+    let mut levels: NetLevels<Price, Qty> = Default::default();
+    let mut starting_levels = Vec::with_capacity(net_changes.len());
+    for changes in net_changes {
+        starting_levels.push(levels.clone());
+        for (side_levels, side_changes) in levels.iter_mut().zip(changes) {
+            for (price, qty) in side_changes {
+                let level_qty = side_levels.entry(price).or_insert(Qty::zero());
+                *level_qty = *level_qty + qty;
+                if level_qty.is_zero() {
+                    side_levels.remove(&price);
+                }
             }
-            (Some(is_bid), Some(price), Some(qty), None, Some(prev_qty)) => {
-                apply_simple_mutation(&mut book, is_bid, price, qty - prev_qty);
+        }
+    }
+
+    let chunk_bbos: Vec<BboBuilder<Price, Qty>> = chunk_starts
+        .into_par_iter()
+        .zip(starting_levels)
+        .map(|(start, levels)| {
+            let mut book = new_book();
+            for (is_bid, side_levels) in [false, true].into_iter().zip(levels) {
+                for (price, qty) in side_levels {
+                    if qty.is_positive() {
+                        book.apply_simple_mutation(is_bid, price, qty);
+                    }
+                }
             }
-            _ => panic!("Invalid input tuple: {:?}", tuple),
+            replay_simple_mutations(book, chunk_rows(start), PARALLEL_CHUNK_LEN)
+        })
+        .collect();
+
+    let mut bbo = BboBuilder::with_capacity(length);
+    for chunk_bbo in chunk_bbos {
+        bbo.append(chunk_bbo);
+    }
+    bbo.finish()
+}
+
+/// Calculate the best bid and best ask prices and quantities
+/// when every mutation adds qty. Without deletes a side's best price is
+/// the running max (bids) or min (asks) of its prices, and its qty only
+/// accumulates while that price is added to again, so no book is needed.
+fn calculate_bbo_from_additions<Price: PriceType, Qty: QtyType>(
+    price_array: &[Price],
+    qty_array: &[Qty],
+    is_bid_array: &Bitmap,
+) -> PolarsResult<Series> {
+    let length = price_array.len();
+    let mut bbo = BboBuilder::with_capacity(length);
+
+    // Best price and qty per side, offers at 0 and bids at 1 as in OrderBook.
+    // They are only meaningful once the side has seen a row.
+    let mut best_price = [Price::default(); 2];
+    let mut best_qty = [Qty::default(); 2];
+    let mut has_best = [false; 2];
+    for (is_bid, &price, &qty) in izip!(is_bid_array.iter(), price_array, qty_array) {
+        let side = is_bid as usize;
+        if has_best[side] && best_price[side] == price {
+            best_qty[side] = best_qty[side] + qty;
+        } else if !has_best[side] || (price > best_price[side]) == is_bid {
+            best_price[side] = price;
+            best_qty[side] = qty;
+            has_best[side] = true;
         }
-        update_builders_one_side(
-            book.book_side(true),
-            &mut best_bid_builder,
-            &mut best_bid_qty_builder,
-        );
+        bbo.push_bid(best_price[1], best_qty[1], has_best[1]);
+        bbo.push_ask(best_price[0], best_qty[0], has_best[0]);
+    }
+    bbo.finish()
+}
+
+/// Calculate the best bid and best ask prices and quantities
+/// using price-point mutations which may include modifies, i.e.
+/// a delete and an add operation in a single row.
+fn calculate_bbo_with_modifies<Price: PriceType, Qty: QtyType>(
+    price_array: &[Price],
+    qty_array: &[Qty],
+    is_bid_array: &Bitmap,
+    prev_price_array: &PrimitiveArray<Price>,
+    prev_qty_array: &PrimitiveArray<Qty>,
+) -> PolarsResult<Series> {
+    let prev_prices = prev_price_array.values().as_slice();
+    let prev_qtys = prev_qty_array.values().as_slice();
 
-        update_builders_one_side(
-            book.book_side(false),
-            &mut best_ask_builder,
-            &mut best_ask_qty_builder,
+    // When every row is a modify the validity is a constant iterator, so the
+    // replay loop is compiled a second time without the per-row validity loads
+    // and with the simple mutation branch folded away.
+    if prev_price_array.null_count() == 0 && prev_qty_array.null_count() == 0 {
+        return replay_modifies(
+            price_array,
+            qty_array,
+            is_bid_array,
+            std::iter::repeat(true),
+            prev_prices,
+            std::iter::repeat(true),
+            prev_qtys,
         );
     }
-    let result = df!(
-        "best_bid"=>best_bid_builder.finish().into_series(),
-        "best_bid_qty"=>best_bid_qty_builder.finish().into_series(),
-        "best_ask"=>best_ask_builder.finish().into_series(),
-        "best_ask_qty"=>best_ask_qty_builder.finish().into_series()
-    )?
-    .into_struct("bbo")
-    .into_series();
-    Ok(result)
+
+    let prev_price_valid = validity_bitmap(prev_price_array);
+    let prev_qty_valid = validity_bitmap(prev_qty_array);
+    polars_ensure!(
+        (&prev_price_valid & &!&prev_qty_valid).set_bits() == 0,
+        ComputeError: "prev_qty must be given wherever prev_price is given"
+    );
+    replay_modifies(
+        price_array,
+        qty_array,
+        is_bid_array,
+        prev_price_valid.iter(),
+        prev_prices,
+        prev_qty_valid.iter(),
+        prev_qtys,
+    )
 }
 
-fn apply_simple_mutation(book: &mut OrderBook<i64, i64>, is_bid: bool, price: i64, qty: i64) {
-    if qty > 0 {
+fn replay_modifies<Price: PriceType, Qty: QtyType>(
+    price_array: &[Price],
+    qty_array: &[Qty],
+    is_bid_array: &Bitmap,
+    prev_price_valid: impl Iterator<Item = bool>,
+    prev_price_array: &[Price],
+    prev_qty_valid: impl Iterator<Item = bool>,
+    prev_qty_array: &[Qty],
+) -> PolarsResult<Series> {
+    let length = price_array.len();
+    let mut bbo = BboBuilder::with_capacity(length);
+
+    let mut book: OrderBook<Price, Qty> = OrderBook::default();
+    for (is_bid, &price, &qty, has_prev_price, &prev_price, has_prev_qty, &prev_qty) in izip!(
+        is_bid_array.iter(),
+        price_array,
+        qty_array,
+        prev_price_valid,
+        prev_price_array,
+        prev_qty_valid,
+        prev_qty_array
+    ) {
+        // Null prev_qty values act as zero, which folds the "no previous level"
+        // and "qty-only modify" rows into one simple mutation. The select on
+        // validity compiles to a conditional move rather than a branch.
+        let prev_qty = if has_prev_qty { prev_qty } else { Qty::zero() };
+        if has_prev_price {
+            book.modify_qty(is_bid, prev_price, prev_qty, price, qty)
+        } else {
+            apply_simple_mutation(&mut book, is_bid, price, qty - prev_qty);
+        }
+        bbo.push_book(&mut book);
+    }
+    bbo.finish()
+}
+
+fn apply_simple_mutation<Price: PriceType, Qty: QtyType>(
+    book: &mut OrderBook<Price, Qty>,
+    is_bid: bool,
+    price: Price,
+    qty: Qty,
+) {
+    if qty.is_positive() {
         book.book_side(is_bid).add_qty(price, qty)
     } else {
         book.book_side(is_bid)
@@ -183,13 +495,137 @@ fn apply_simple_mutation(book: &mut OrderBook<i64, i64>, is_bid: bool, price: i6
     }
 }
 
-fn update_builders_one_side(
-    book_side: &BookSide<i64, i64>,
-    price_builder: &mut PrimitiveChunkedBuilder<Int64Type>,
-    qty_builder: &mut PrimitiveChunkedBuilder<Int64Type>,
-) {
-    price_builder.append_option(book_side.best_price);
-    qty_builder.append_option(book_side.best_price_qty);
+/// Best price and qty of a book side, and whether it has any levels, matching
+/// `DenseBookSide::best_level`. The pair of `Option` fields is matched once.
+#[inline]
+fn best_level<Price: PriceType, Qty: QtyType>(
+    book_side: &BookSide<Price, Qty>,
+) -> (Price, Qty, bool) {
+    match (book_side.best_price, book_side.best_price_qty) {
+        (Some(price), Some(qty)) => (price, qty, true),
+        _ => (Price::default(), Qty::default(), false),
+    }
+}
+
+/// Output buffers for the bbo struct.
+///
+/// Values are written into preallocated vectors. A side's price and qty are
+/// always null together, so each side has a single validity bitmap, which is
+/// accumulated in 64-row words rather than pushed one bit at a time. Rows of
+/// an empty side are written as default values with their validity bit unset.
+struct BboBuilder<Price, Qty> {
+    best_bid: Vec<Price>,
+    best_bid_qty: Vec<Qty>,
+    best_ask: Vec<Price>,
+    best_ask_qty: Vec<Qty>,
+    bid_validity: ValidityBuilder,
+    ask_validity: ValidityBuilder,
+}
+
+impl<Price: PriceType, Qty: QtyType> BboBuilder<Price, Qty> {
+    fn with_capacity(capacity: usize) -> Self {
+        BboBuilder {
+            best_bid: Vec::with_capacity(capacity),
+            best_bid_qty: Vec::with_capacity(capacity),
+            best_ask: Vec::with_capacity(capacity),
+            best_ask_qty: Vec::with_capacity(capacity),
+            bid_validity: ValidityBuilder::with_capacity(capacity),
+            ask_validity: ValidityBuilder::with_capacity(capacity),
+        }
+    }
+
+    #[inline]
+    fn push_bid(&mut self, price: Price, qty: Qty, is_valid: bool) {
+        self.best_bid.push(price);
+        self.best_bid_qty.push(qty);
+        self.bid_validity.push(is_valid);
+    }
+
+    #[inline]
+    fn push_ask(&mut self, price: Price, qty: Qty, is_valid: bool) {
+        self.best_ask.push(price);
+        self.best_ask_qty.push(qty);
+        self.ask_validity.push(is_valid);
+    }
+
+    #[inline]
+    fn push_book(&mut self, book: &mut OrderBook<Price, Qty>) {
+        let (bid_price, bid_qty, has_bid) = best_level(book.book_side(true));
+        self.push_bid(bid_price, bid_qty, has_bid);
+        let (ask_price, ask_qty, has_ask) = best_level(book.book_side(false));
+        self.push_ask(ask_price, ask_qty, has_ask);
+    }
+
+    /// Append the rows of another builder, which must follow a whole number of
+    /// validity words.
+    fn append(&mut self, other: Self) {
+        self.best_bid.extend(other.best_bid);
+        self.best_bid_qty.extend(other.best_bid_qty);
+        self.best_ask.extend(other.best_ask);
+        self.best_ask_qty.extend(other.best_ask_qty);
+        self.bid_validity.append(other.bid_validity);
+        self.ask_validity.append(other.ask_validity);
+    }
+
+    fn finish(self) -> PolarsResult<Series> {
+        let bid_validity = self.bid_validity.finish();
+        let ask_validity = self.ask_validity.finish();
+        let result = df!(
+            "best_bid"=>to_series("best_bid", self.best_bid, &bid_validity)?,
+            "best_bid_qty"=>to_series("best_bid_qty", self.best_bid_qty, &bid_validity)?,
+            "best_ask"=>to_series("best_ask", self.best_ask, &ask_validity)?,
+            "best_ask_qty"=>to_series("best_ask_qty", self.best_ask_qty, &ask_validity)?
+        )?
+        .into_struct("bbo")
+        .into_series();
+        Ok(result)
+    }
+}
+
+fn to_series<T: NativeType>(name: &str, values: Vec<T>, validity: &Bitmap) -> PolarsResult<Series> {
+    let array = PrimitiveArray::from_vec(values).with_validity(Some(validity.clone()));
+    Series::from_arrow(name, array.boxed())
+}
+
+/// Validity bitmap built one 64-row word at a time.
+struct ValidityBuilder {
+    bytes: Vec<u8>,
+    word: u64,
+    len: usize,
+}
+
+impl ValidityBuilder {
+    fn with_capacity(capacity: usize) -> Self {
+        ValidityBuilder {
+            bytes: Vec::with_capacity(capacity.div_ceil(8)),
+            word: 0,
+            len: 0,
+        }
+    }
+
+    #[inline]
+    fn push(&mut self, is_valid: bool) {
+        self.word |= (is_valid as u64) << (self.len % 64);
+        self.len += 1;
+        if self.len % 64 == 0 {
+            self.bytes.extend_from_slice(&self.word.to_le_bytes());
+            self.word = 0;
+        }
+    }
+
+    fn append(&mut self, other: ValidityBuilder) {
+        assert_eq!(self.len % 64, 0, "Can only append at a word boundary");
+        self.bytes.extend_from_slice(&other.bytes);
+        self.word = other.word;
+        self.len += other.len;
+    }
+
+    fn finish(mut self) -> Bitmap {
+        let tail_bytes = (self.len % 64).div_ceil(8);
+        self.bytes
+            .extend_from_slice(&self.word.to_le_bytes()[..tail_bytes]);
+        Bitmap::from_u8_vec(self.bytes, self.len)
+    }
 }
 
 #[cfg(test)]
@@ -225,6 +661,185 @@ mod tests {
         assert_eq!(df, expected);
     }
 
+    #[test]
+    fn test_calculate_bbo_from_additions_at_same_price() {
+        let mut df = df! {
+            "price" => [5i64, 5, 4, 6, 7, 7, 6],
+            "qty" => [1i64, 2, 3, 4, 5, 6, 7],
+            "is_bid" => [true, true, true, true, false, false, false],
+        }
+        .unwrap();
+        let inputs = df.get_columns();
+
+        let bbo_struct = _pl_calculate_bbo(inputs).unwrap();
+        df = df
+            .with_column(bbo_struct)
+            .expect("Failed to add BBO struct series to DataFrame")
+            .unnest(["bbo"])
+            .expect("Failed to unnest BBO struct series");
+
+        let expected = df! {
+            "price" => [5i64, 5, 4, 6, 7, 7, 6],
+            "qty" => [1i64, 2, 3, 4, 5, 6, 7],
+            "is_bid" => [true, true, true, true, false, false, false],
+            "best_bid" => [5i64, 5, 5, 6, 6, 6, 6],
+            "best_bid_qty" => [1i64, 3, 3, 4, 4, 4, 4],
+            "best_ask" => [None, None, None, None, Some(7i64), Some(7), Some(6)],
+            "best_ask_qty" => [None, None, None, None, Some(5i64), Some(11), Some(7)],
+        }
+        .unwrap();
+        assert_eq!(df, expected);
+    }
+
+    #[test]
+    fn test_calculate_bbo_int32() {
+        let df = df! {
+            "price" => [1i32, 2, 9, 9],
+            "qty" => [10i32, 20, 90, -90],
+            "is_bid" => [true, true, false, false],
+        }
+        .unwrap();
+
+        let bbo = _pl_calculate_bbo(df.get_columns())
+            .unwrap()
+            .struct_()
+            .unwrap()
+            .clone()
+            .unnest();
+        let expected = df! {
+            "best_bid" => [1i32, 2, 2, 2],
+            "best_bid_qty" => [10i32, 20, 20, 20],
+            "best_ask" => [None, None, Some(9i32), None],
+            "best_ask_qty" => [None, None, Some(90i32), None],
+        }
+        .unwrap();
+        assert_eq!(bbo, expected);
+    }
+
+    #[test]
+    fn test_calculate_bbo_int32_with_int64_modifies() {
+        let df = df! {
+            "price" => [1i32, 2, 9, 8],
+            "qty" => [10i32, 20, 90, 80],
+            "is_bid" => [true, true, false, false],
+            "prev_price" => [None, Some(1i64), None, Some(9)],
+            "prev_qty" => [None, Some(10i64), None, Some(90)],
+        }
+        .unwrap();
+
+        let bbo = _pl_calculate_bbo(df.get_columns())
+            .unwrap()
+            .struct_()
+            .unwrap()
+            .clone()
+            .unnest();
+        let expected = df! {
+            "best_bid" => [1i32, 2, 2, 2],
+            "best_bid_qty" => [10i32, 20, 20, 20],
+            "best_ask" => [None, None, Some(9i32), Some(8)],
+            "best_ask_qty" => [None, None, Some(90i32), Some(80)],
+        }
+        .unwrap();
+        assert_eq!(bbo, expected);
+    }
+
+    /// Orders added at pseudo-random prices and deleted in FIFO order, so the
+    /// book stays small and every delete is valid.
+    fn fifo_mutations(length: usize) -> (Vec<i64>, Vec<i64>, Bitmap) {
+        let mut seed: u64 = 42;
+        let mut resting = std::collections::VecDeque::new();
+        let mut prices = Vec::with_capacity(length);
+        let mut qtys = Vec::with_capacity(length);
+        let mut is_bids = Vec::with_capacity(length);
+        for _ in 0..length {
+            seed = seed.wrapping_mul(6364136223846793005).wrapping_add(1);
+            let order = if resting.len() < 50 || seed >> 63 == 0 {
+                let is_bid = (seed >> 40) % 2 == 0;
+                let price = 100 + ((seed >> 33) % 20) as i64 - 10 * is_bid as i64;
+                let qty = 1 + ((seed >> 20) % 10) as i64;
+                resting.push_back((is_bid, price, qty));
+                (is_bid, price, qty)
+            } else {
+                let (is_bid, price, qty) = resting.pop_front().unwrap();
+                (is_bid, price, -qty)
+            };
+            is_bids.push(order.0);
+            prices.push(order.1);
+            qtys.push(order.2);
+        }
+        (prices, qtys, Bitmap::from_iter(is_bids))
+    }
+
+    /// The bbo from replaying the mutations on a hash map backed `OrderBook`.
+    fn replay_on_order_book(prices: &[i64], qtys: &[i64], is_bid_array: &Bitmap) -> Series {
+        let mut bbo = BboBuilder::with_capacity(prices.len());
+        let mut book: OrderBook<i64, i64> = OrderBook::default();
+        for (is_bid, &price, &qty) in izip!(is_bid_array.iter(), prices, qtys) {
+            apply_simple_mutation(&mut book, is_bid, price, qty);
+            bbo.push_book(&mut book);
+        }
+        bbo.finish().unwrap()
+    }
+
+    #[test]
+    fn test_calculate_bbo_from_simple_mutations_par() {
+        let (prices, qtys, is_bid_array) = fifo_mutations(4 * PARALLEL_CHUNK_LEN + 100);
+        let expected = replay_on_order_book(&prices, &qtys, &is_bid_array);
+        let (min_price, num_levels) = dense_price_window(&prices).unwrap();
+
+        let bbo = calculate_bbo_from_simple_mutations_par(&prices, &qtys, &is_bid_array, || {
+            DenseOrderBook::new(min_price, num_levels)
+        })
+        .unwrap();
+        assert!(bbo.equals_missing(&expected));
+        let bbo = calculate_bbo_from_simple_mutations_par(
+            &prices,
+            &qtys,
+            &is_bid_array,
+            OrderBook::default,
+        )
+        .unwrap();
+        assert!(bbo.equals_missing(&expected));
+        let bbo = calculate_bbo_from_simple_mutations(&prices, &qtys, &is_bid_array).unwrap();
+        assert!(bbo.equals_missing(&expected));
+    }
+
+    #[test]
+    fn test_replay_simple_mutations_on_dense_book() {
+        let (prices, qtys, is_bid_array) = fifo_mutations(10_000);
+        let (min_price, num_levels) = dense_price_window(&prices).unwrap();
+        assert_eq!((min_price, num_levels), (90, 30));
+        let rows = izip!(
+            is_bid_array.iter(),
+            prices.iter().copied(),
+            qtys.iter().copied()
+        );
+        let book = DenseOrderBook::new(min_price, num_levels);
+        let bbo = replay_simple_mutations(book, rows, prices.len())
+            .finish()
+            .unwrap();
+        assert!(bbo.equals_missing(&replay_on_order_book(&prices, &qtys, &is_bid_array)));
+        assert_eq!(dense_price_window(&[0i64, DENSE_PRICE_WINDOW as i64]), None);
+    }
+
+    #[test]
+    fn test_calculate_bbo_with_null_modifies() {
+        let df = df! {
+            "price" => [1i64, 2, 3, 4, 5, 9, 8, 7, 6],
+            "qty" => [10i64, 20, 30, 40, 50, 90, 80, 70, 60],
+            "is_bid" => [true, true, true, true, true, false, false, false, false],
+        }
+        .unwrap();
+        let null_column = Series::full_null("prev", df.height(), &DataType::Int64);
+        let mut inputs = df.get_columns().to_vec();
+        inputs.push(null_column.clone().with_name("prev_price"));
+        inputs.push(null_column.with_name("prev_qty"));
+
+        let with_null_modifies = _pl_calculate_bbo(&inputs).unwrap();
+        let without_modifies = _pl_calculate_bbo(df.get_columns()).unwrap();
+        assert!(with_null_modifies.equals_missing(&without_modifies));
+    }
+
     #[test]
     fn test_calculate_bbo_with_modifies() {
         let mut df = df! {
@@ -2,7 +2,13 @@ import polars as pl
 import pytest
 from polars.testing.asserts import assert_frame_equal
 
-from polars_order_book import calculate_bbo
+from polars_order_book import _numba_fallback, calculate_bbo, calculate_bbo_columns
+
+# Tests going through `calculate_bbo` exercise the compiled plugin, so they fail
+# rather than silently run on the Python fallback when the plugin is not built.
+pytestmark = pytest.mark.filterwarnings(
+    "error:polars_order_book could not find its compiled plugin"
+)
 
 
 @pytest.mark.parametrize("n", [1, 10, 100, 1000])
@@ -226,3 +232,256 @@ def test_multiple_orders_per_level_modify(n: int, is_bid: bool):
         expected,
         check_column_order=False,
     )
+
+
+def test_calculate_bbo_fallback():
+    market_data = pl.DataFrame(
+        {
+            "price": [1, 6, 2, 3, 1, 5, 4, 6],
+            "qty": [1, 6, 2, 3, 1, 5, 4, 6],
+            "is_bid": [True, False, True, True, True, False, False, False],
+            "prev_price": [None, None, 1, 2, 3, 6, 5, 4],
+            "prev_qty": [None, None, 1, 2, 3, 6, 5, 4],
+        },
+        schema={
+            "price": pl.Int64,
+            "qty": pl.Int64,
+            "is_bid": pl.Boolean,
+            "prev_price": pl.Int64,
+            "prev_qty": pl.Int64,
+        },
+    )
+    args = [pl.col(c) for c in market_data.columns]
+    result = market_data.select(
+        bbo=_numba_fallback.calculate_bbo_fallback(args)
+    ).unnest("bbo")
+
+    expected = pl.DataFrame(
+        {
+            "best_bid": [1, 1, 2, 3, 1, 1, 1, 1],
+            "best_bid_qty": [1, 1, 2, 3, 1, 1, 1, 1],
+            "best_ask": [None, 6, 6, 6, 6, 5, 4, 6],
+            "best_ask_qty": [None, 6, 6, 6, 6, 5, 4, 6],
+        },
+        schema={field: pl.Int64 for field in result.columns},
+    )
+    assert_frame_equal(result, expected)
+
+
+@pytest.mark.parametrize("n", [1, 10, 100])
+def test_calculate_bbo_by_symbol(n: int):
+    # Two symbols replay the same mutations, with b's prices offset by 10,
+    # interleaved row by row.
+    prices = [1, 2, 3, 6, 5, 4, 3, 1, 2, 5, 4, 6]
+    market_data = pl.DataFrame(
+        {
+            "symbol": ["a", "b"] * 12 * n,
+            "price": [p + offset for p in prices for offset in (0, 10)] * n,
+            "qty": [
+                q for q in [1, 2, 3, 6, 5, 4, -3, -1, -2, -5, -4, -6] for _ in range(2)
+            ]
+            * n,
+            "is_bid": [
+                b
+                for b in [True] * 3 + [False] * 3 + [True] * 3 + [False] * 3
+                for _ in range(2)
+            ]
+            * n,
+        },
+        schema={
+            "symbol": pl.String,
+            "price": pl.Int64,
+            "qty": pl.Int64,
+            "is_bid": pl.Boolean,
+        },
+    )
+    market_data = market_data.with_columns(
+        bbo=calculate_bbo("price", "qty", "is_bid", by="symbol")
+    ).unnest("bbo")
+
+    def interleave(a: list, b: list) -> list:
+        return [x for pair in zip(a, b) for x in pair] * n
+
+    def offset(values: list) -> list:
+        return [None if v is None else v + 10 for v in values]
+
+    best_bid = [1, 2, 3, 3, 3, 3, 2, 2, None, None, None, None]
+    best_ask = [None, None, None, 6, 5, 4, 4, 4, 4, 4, 6, None]
+    expected = pl.DataFrame(
+        {
+            "best_bid": interleave(best_bid, offset(best_bid)),
+            "best_ask": interleave(best_ask, offset(best_ask)),
+            "best_bid_qty": interleave(best_bid, best_bid),
+            "best_ask_qty": interleave(best_ask, best_ask),
+        },
+        schema={
+            field: pl.Int64
+            for field in ["best_bid", "best_ask", "best_bid_qty", "best_ask_qty"]
+        },
+    )
+
+    assert_frame_equal(
+        market_data.select("best_bid", "best_ask", "best_bid_qty", "best_ask_qty"),
+        expected,
+    )
+
+
+def test_calculate_bbo_columns():
+    market_data = pl.DataFrame(
+        {
+            "price": [1, 2, 3, 6, 5, 4, 3, 1, 2, 5, 4, 6],
+            "qty": [1, 2, 3, 6, 5, 4, -3, -1, -2, -5, -4, -6],
+            "is_bid": [True] * 3 + [False] * 3 + [True] * 3 + [False] * 3,
+        },
+        schema={"price": pl.Int64, "qty": pl.Int64, "is_bid": pl.Boolean},
+    )
+    result = market_data.with_columns(calculate_bbo_columns("price", "qty", "is_bid"))
+    expected = market_data.with_columns(
+        bbo=calculate_bbo("price", "qty", "is_bid")
+    ).unnest("bbo")
+
+    assert_frame_equal(result, expected)
+
+
+def test_calculate_bbo_reuses_expr_for_column_names():
+    bbo = calculate_bbo("price", "qty", "is_bid", "prev_price", "prev_qty")
+    assert bbo is calculate_bbo("price", "qty", "is_bid", "prev_price", "prev_qty")
+    assert bbo is not calculate_bbo("price", "qty", "is_bid")
+
+
+def test_calculate_bbo_with_null_literal_prev():
+    market_data = pl.DataFrame(
+        {
+            "price": [1, 2, 3, 6, 5, 4, 3, 1, 2, 5, 4, 6],
+            "qty": [1, 2, 3, 6, 5, 4, -3, -1, -2, -5, -4, -6],
+            "is_bid": [True] * 3 + [False] * 3 + [True] * 3 + [False] * 3,
+        },
+        schema={"price": pl.Int64, "qty": pl.Int64, "is_bid": pl.Boolean},
+    )
+    null = pl.lit(None, dtype=pl.Int64)
+    bbo = calculate_bbo("price", "qty", "is_bid", null, null)
+
+    assert bbo is calculate_bbo("price", "qty", "is_bid")
+    assert_frame_equal(
+        market_data.select(bbo=bbo),
+        market_data.select(bbo=calculate_bbo("price", "qty", "is_bid")),
+    )
+
+
+def test_calculate_bbo_with_series_literal_prev():
+    # A Series literal with some nulls is a real prev column, not a null literal.
+    market_data = pl.DataFrame(
+        {"price": [2, 2], "qty": [5, 3], "is_bid": [True, True]},
+        schema={"price": pl.Int64, "qty": pl.Int64, "is_bid": pl.Boolean},
+    )
+    prev_price = pl.lit(pl.Series([None, 2], dtype=pl.Int64))
+    prev_qty = pl.lit(pl.Series([None, 5], dtype=pl.Int64))
+    result = market_data.select(
+        calculate_bbo("price", "qty", "is_bid", prev_price, prev_qty)
+    ).unnest("bbo")
+
+    assert result["best_bid"].to_list() == [2, 2]
+    assert result["best_bid_qty"].to_list() == [5, 3]
+
+
+def test_calculate_bbo_int32_with_int64_prev():
+    market_data = pl.DataFrame(
+        {
+            "price": [1, 2, 9, 8],
+            "qty": [10, 20, 90, 80],
+            "is_bid": [True, True, False, False],
+            "prev_price": [None, 1, None, 9],
+            "prev_qty": [None, 10, None, 90],
+        },
+        schema_overrides={"price": pl.Int32, "qty": pl.Int32},
+    )
+    result = market_data.select(
+        calculate_bbo_columns("price", "qty", "is_bid", "prev_price", "prev_qty")
+    )
+
+    expected = pl.DataFrame(
+        {
+            "best_bid": [1, 2, 2, 2],
+            "best_bid_qty": [10, 20, 20, 20],
+            "best_ask": [None, None, 9, 8],
+            "best_ask_qty": [None, None, 90, 80],
+        },
+        schema={field: pl.Int32 for field in result.columns},
+    )
+    assert_frame_equal(result, expected)
+
+
+def test_calculate_bbo_warns_when_falling_back(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr("polars_order_book.lib", None)
+    market_data = pl.DataFrame(
+        {"price": [1, 2], "qty": [5, 3], "is_bid": [True, False]},
+    )
+    with pytest.warns(UserWarning, match="could not find its compiled plugin"):
+        bbo = calculate_bbo(pl.col("price"), pl.col("qty"), pl.col("is_bid"))
+    result = market_data.select(bbo).unnest("bbo")
+
+    expected = pl.DataFrame(
+        {
+            "best_bid": [1, 1],
+            "best_bid_qty": [5, 5],
+            "best_ask": [None, 2],
+            "best_ask_qty": [None, 3],
+        },
+    )
+    assert_frame_equal(result, expected)
+
+
+def test_calculate_bbo_fallback_keeps_input_dtypes():
+    market_data = pl.DataFrame(
+        {
+            "price": [1, 2, 9, 9],
+            "qty": [10, 20, 90, -90],
+            "is_bid": [True, True, False, False],
+        },
+        schema={"price": pl.Int32, "qty": pl.Int32, "is_bid": pl.Boolean},
+    )
+    bbo = _numba_fallback.calculate_bbo_fallback(
+        [pl.col("price"), pl.col("qty"), pl.col("is_bid")]
+    )
+    expected_schema = pl.Schema(
+        {
+            "bbo": pl.Struct(
+                {
+                    "best_bid": pl.Int32,
+                    "best_bid_qty": pl.Int32,
+                    "best_ask": pl.Int32,
+                    "best_ask_qty": pl.Int32,
+                }
+            )
+        }
+    )
+
+    assert market_data.lazy().select(bbo).collect_schema() == expected_schema
+    assert market_data.select(bbo).schema == expected_schema
+
+
+@pytest.mark.parametrize("new_price", [2, 3])
+def test_calculate_bbo_fallback_modify_to_zero_qty(new_price: int):
+    market_data = pl.DataFrame(
+        {
+            "price": [2, new_price],
+            "qty": [5, 0],
+            "is_bid": [True, True],
+            "prev_price": [None, 2],
+            "prev_qty": [None, 5],
+        },
+        schema={
+            "price": pl.Int64,
+            "qty": pl.Int64,
+            "is_bid": pl.Boolean,
+            "prev_price": pl.Int64,
+            "prev_qty": pl.Int64,
+        },
+    )
+    args = [pl.col(name) for name in market_data.columns]
+    result = market_data.select(_numba_fallback.calculate_bbo_fallback(args)).unnest(
+        "bbo"
+    )
+
+    assert result["best_bid"].to_list() == [2, None]
+    assert result["best_bid_qty"].to_list() == [5, None]